@@ -1,6 +1,6 @@
 import re
 import os
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Callable, Optional, Iterator
 from datetime import datetime
 from extractor import InfoExtractorBuilder, calcular_fecha_entrada, formato_fecha_espanol
 
@@ -77,6 +77,9 @@ EXAMPLES = """EJEMPLO 1:
 # Configuración
 MODELO = "gpt-4o-mini"
 
+# Consumir las respuestas en streaming para cancelar las que no son JSON válido
+STREAMING = True
+
 # Configuración del schema JSON
 JSON_SCHEMA = {
   "type": "json_schema",
@@ -323,8 +326,12 @@ MESSAGES_CONFIG = {
             "utilizando el formato JSON exacto: {json_template}. "
             "Aquí está la definición de cada clave: {field_definitions} "
             "Ejemplo de nota: {input_example}"
-            "Texto de la nota: {input_text}"
         )
+    },
+    # Único mensaje que cambia en cada llamada; va al final para que el resto se reutilice de la caché
+    "entrada": {
+        "role": "user",
+        "content": "Texto de la nota: {input_text}"
     }
 }
 
@@ -481,20 +488,38 @@ DIA_PATTERN = re.compile(r'(\d{1,2})(?!.*\d)')
 ENTRADA_PATTERN = re.compile(r'\n(?=[A-ZÁÉÍÓÚÜÑ][a-záéíóúüñ]+)')
 #ENTRADA_PATTERN = re.compile(r'\n(?=[A-Z][a-z]+)')
 
-def procesar_archivo(nombre_archivo: str, contenido: str) -> List[Dict[str, Any]]:
+def crear_extractor(con_cliente: bool = True):
     """
-    Procesa un archivo y extrae la información relevante.
+    Construye el extractor con la configuración de este módulo.
+    Con con_cliente=False no se crea el cliente de OpenAI (p. ej. para planificar sin API).
+    """
+    builder = InfoExtractorBuilder()
+    if con_cliente:
+        builder = builder.with_api_key(os.environ.get("OPENAI_API_KEY"))
+    return builder\
+        .with_model(MODELO)\
+        .with_json_schema(JSON_SCHEMA)\
+        .with_model_config(MODEL_CONFIG)\
+        .with_field_definitions(FIELD_DEFINITIONS)\
+        .with_messages_config(MESSAGES_CONFIG)\
+        .with_json_template(JSON_TEMPLATE)\
+        .with_examples(EXAMPLES)\
+        .with_streaming(STREAMING)\
+        .build()
+
+def generar_entradas(nombre_archivo: str, contenido: str) -> Iterator[Dict[str, Any]]:
+    """
+    Segmenta un archivo y genera los registros de cada entrada, sin el campo 'data'.
     """
     # Paso 1: Aplicar las funciones de split para obtener los segmentos
     segmentos = dividir_texto_maritimo(contenido)
     
-    datos = []
     id_counter = 1
     
     fecha_nota = nombre_archivo[:10] if len(nombre_archivo) >= 10 else ""
     nombre_prensa = nombre_archivo[15:17] if len(nombre_archivo) >= 10 else ""
 
-    # Paso 2 y 3: Procesar cada segmento
+    # Paso 2: Obtener los metadatos y las entradas de cada segmento
     for segmento in segmentos:
         # Extraer metadatos del segmento
         match_segmento = METADATA_PATTERN.search(segmento)
@@ -516,28 +541,11 @@ def procesar_archivo(nombre_archivo: str, contenido: str) -> List[Dict[str, Any]
         
         metadata_segmento = metadata_segmento.rstrip()
         
-        extractor = InfoExtractorBuilder()\
-            .with_api_key(os.environ.get("OPENAI_API_KEY"))\
-            .with_model(MODELO)\
-            .with_json_schema(JSON_SCHEMA)\
-            .with_model_config(MODEL_CONFIG)\
-            .with_field_definitions(FIELD_DEFINITIONS)\
-            .with_messages_config(MESSAGES_CONFIG)\
-            .with_json_template(JSON_TEMPLATE)\
-            .with_examples(EXAMPLES)\
-            .build()
-        
         for entrada in entradas:
             if entrada.strip():
                 entrada_con_fecha = f"Fecha de arribo: {fecha_arribo_texto}; puerto de salida: {entrada.strip()}"
                 
-                try:
-                    resultado_json = extractor.extraer_informacion(entrada_con_fecha)
-                except Exception as e:
-                    print(f"Error al procesar la entrada con InfoExtractor: {str(e)}")
-                    resultado_json = {"error": "No se pudo procesar la entrada"}
-                
-                datos.append({
+                yield {
                     'name_txt': nombre_archivo,
                     'metadata_entrada': metadata_segmento,
                     'publication_date': fecha_nota,
@@ -547,10 +555,39 @@ def procesar_archivo(nombre_archivo: str, contenido: str) -> List[Dict[str, Any]
                     'dia': dia,
                     'fecha_entrada': nueva_fecha_entrada.strftime('%Y_%m_%d') if nueva_fecha_entrada else None,
                     'entrada': entrada_con_fecha,
-                    'id_entrada': id_counter,
-                    'data': resultado_json
-                })
+                    'id_entrada': id_counter
+                }
                 
                 id_counter += 1
+
+def procesar_archivo(nombre_archivo: str, contenido: str,
+                     on_parcial: Optional[Callable[[int, str, str, Any], None]] = None,
+                     on_descarte: Optional[Callable[[int, str], None]] = None) -> List[Dict[str, Any]]:
+    """
+    Procesa un archivo y extrae la información relevante.
+    Si se indica on_parcial, se llama con (id_entrada, modelo, clave, valor) cada vez
+    que un campo de la respuesta se completa, antes de que termine la entrada. Si el
+    intento de un modelo se descarta, se llama on_descarte(id_entrada, modelo) y los
+    campos que ese modelo envió para la entrada dejan de ser válidos.
+    """
+    datos = []
+    extractor = crear_extractor()
+
+    # Paso 3: Extraer la información de cada entrada
+    for registro in generar_entradas(nombre_archivo, contenido):
+        try:
+            id_entrada = registro['id_entrada']
+            on_partial = (lambda modelo, clave, valor, id_entrada=id_entrada: on_parcial(id_entrada, modelo, clave, valor)) if on_parcial else None
+            descarte = (lambda modelo, id_entrada=id_entrada: on_descarte(id_entrada, modelo)) if on_descarte else None
+            resultado_json = extractor.extraer_informacion(registro['entrada'], on_partial, descarte)
+        except Exception as e:
+            print(f"Error al procesar la entrada con InfoExtractor: {str(e)}")
+            resultado_json = {"error": "No se pudo procesar la entrada"}
+        
+        registro['data'] = resultado_json
+        if extractor.ultimo_resultado_reparado:
+            registro['data_repaired'] = True
+        datos.append(registro)
     
+    print(f"Caché de prompts en {nombre_archivo}: {extractor.resumen_cache()}")
     return datos
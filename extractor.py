@@ -1,9 +1,341 @@
 from openai import OpenAI
 import json
-from typing import Dict, Any, Optional, List, Union
+import re
+from typing import Dict, Any, Optional, List, Union, Callable, Tuple
 from datetime import datetime, timedelta
 from babel.dates import format_date
 
+class RespuestaAbortadaError(ValueError):
+    """
+    La respuesta en streaming se canceló porque no puede ser un JSON válido.
+    """
+
+# Tipos estructurados del schema y su equivalente en Python
+TIPOS_SCHEMA = {
+    "array": list,
+    "object": dict,
+}
+
+class ParserJSONIncremental:
+    """
+    Analiza un objeto JSON que llega por fragmentos y emite cada campo de primer
+    nivel en cuanto su valor está completo. Registra un error en cuanto la salida
+    deja de poder ser válida según las propiedades del schema. Lo que ReparadorJSON
+    sabe corregir (bloque markdown inicial, comillas simples, texto tras el objeto)
+    no se considera un error.
+    """
+    def __init__(self, propiedades: Optional[Dict[str, Any]] = None,
+                 on_partial: Optional[Callable[[str, Any], None]] = None,
+                 longitud_maxima_cadena: int = 2000):
+        self._propiedades = propiedades or {}
+        self._on_partial = on_partial
+        self._longitud_maxima_cadena = longitud_maxima_cadena
+        self._texto = ""
+        self._pos = 0
+        self._pila: List[str] = []
+        self._en_cadena = False
+        self._comilla = '"'
+        self._escape = False
+        self._inicio_cadena = None
+        self._preambulo = ""
+        self._esperando_clave = False
+        self._clave_actual = None
+        self._inicio_valor = None
+        self._valor_iniciado = False
+        self._en_escalar = False
+        self.iniciado = False
+        self.terminado = False
+        self.campos: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+
+    def alimentar(self, fragmento: str) -> bool:
+        """
+        Añade un fragmento de la respuesta. Devuelve False si la salida ya no puede ser válida.
+        """
+        if self.error:
+            return False
+        self._texto += fragmento
+        while self._pos < len(self._texto) and not self.error:
+            self._procesar_caracter(self._texto[self._pos])
+            self._pos += 1
+        return self.error is None
+
+    def _procesar_caracter(self, c: str) -> None:
+        if self._en_cadena:
+            if self._escape:
+                self._escape = False
+            elif c == '\\':
+                self._escape = True
+            elif c == self._comilla:
+                self._en_cadena = False
+                self._cerrar_cadena()
+            elif self._pos - self._inicio_cadena > self._longitud_maxima_cadena:
+                self.error = "cadena demasiado larga (posible texto repetido)"
+            return
+
+        if c.isspace() or self.terminado:
+            return
+        if not self.iniciado:
+            if c != '{':
+                # Se admite un bloque markdown inicial (```json) antes del objeto
+                self._preambulo += c
+                if not re.fullmatch(r'`{1,3}[A-Za-z]*', self._preambulo):
+                    self.error = f"la respuesta no comienza con un objeto JSON ({self._preambulo!r})"
+                return
+            self.iniciado = True
+
+        if len(self._pila) == 1 and self._inicio_valor is not None and not self._valor_iniciado:
+            self._valor_iniciado = True
+            self._en_escalar = c not in '{["\''
+        if self._en_escalar and c in '{[]':
+            # Corchetes dentro de un valor sin comillas (p. ej. 75 1[4): no son estructura;
+            # el valor no decodificará y se reparará al final, como sin streaming
+            return
+
+        if c in '"\'':
+            self._en_cadena = True
+            self._comilla = c
+            self._inicio_cadena = self._pos
+        elif c in '{[':
+            self._pila.append('}' if c == '{' else ']')
+            if len(self._pila) == 1:
+                self._esperando_clave = True
+        elif c in '}]':
+            if not self._pila or self._pila[-1] != c:
+                self.error = f"cierre inesperado {c!r}"
+                return
+            if len(self._pila) == 1:
+                self._cerrar_valor()
+                self.terminado = True
+            self._pila.pop()
+        elif len(self._pila) == 1:
+            if c == ':':
+                if self._clave_actual is None:
+                    self.error = "separador ':' sin clave"
+                    return
+                self._esperando_clave = False
+                self._inicio_valor = self._pos + 1
+                self._valor_iniciado = False
+            elif c == ',':
+                self._cerrar_valor()
+                self._esperando_clave = True
+            elif self._esperando_clave:
+                self.error = f"se esperaba una clave entre comillas ({c!r})"
+
+    def _cerrar_cadena(self) -> None:
+        if len(self._pila) != 1 or not self._esperando_clave:
+            return
+        crudo = self._texto[self._inicio_cadena:self._pos + 1]
+        clave = json.loads(crudo) if self._comilla == '"' else crudo[1:-1].replace("\\'", "'")
+        if self._propiedades and clave not in self._propiedades:
+            self.error = f"clave inesperada '{clave}'"
+        elif clave in self.campos:
+            self.error = f"clave repetida '{clave}'"
+        else:
+            self._clave_actual = clave
+
+    def _cerrar_valor(self) -> None:
+        self._en_escalar = False
+        if self._clave_actual is None or self._inicio_valor is None:
+            return
+        clave = self._clave_actual
+        self._clave_actual = None
+        try:
+            valor = json.loads(self._texto[self._inicio_valor:self._pos])
+        except json.JSONDecodeError:
+            # Un valor mal formado (p. ej. tons sin comillas) se puede reparar al final
+            return
+        finally:
+            self._inicio_valor = None
+
+        # Solo se exige la estructura (listas y objetos); las diferencias entre
+        # escalares, como 200 frente a "200", se toleran igual que sin streaming
+        tipo = self._propiedades.get(clave, {}).get("type")
+        if valor is not None and tipo in TIPOS_SCHEMA and not isinstance(valor, TIPOS_SCHEMA[tipo]):
+            self.error = f"tipo inesperado para la clave '{clave}': {type(valor).__name__}"
+            return
+
+        self.campos[clave] = valor
+        if self._on_partial:
+            self._on_partial(clave, valor)
+
+LITERALES_JSON = {
+    'true': True, 'false': False, 'null': None,
+    'True': True, 'False': False, 'None': None,
+}
+
+class _TextoIncompleto(Exception):
+    def __init__(self, parcial: Any = None):
+        super().__init__("texto incompleto")
+        self.parcial = parcial
+
+class ReparadorJSON:
+    """
+    Parser tolerante para respuestas casi JSON: admite bloques markdown, comas
+    sobrantes o ausentes, comillas simples, valores sin comillas (tons) y
+    literales de Python. Si el texto está cortado, descarta el elemento
+    incompleto y cierra las listas y objetos abiertos.
+    """
+    def __init__(self, texto: str):
+        self._texto = texto
+        self._pos = 0
+
+    def reparar(self) -> Optional[Dict[str, Any]]:
+        self._pos = self._texto.find('{')
+        if self._pos < 0:
+            return None
+        try:
+            resultado = self._valor()
+        except _TextoIncompleto as e:
+            resultado = e.parcial
+        except ValueError:
+            return None
+        return resultado if isinstance(resultado, dict) and resultado else None
+
+    def _actual(self) -> Optional[str]:
+        return self._texto[self._pos] if self._pos < len(self._texto) else None
+
+    def _saltar(self, caracteres: str = '') -> None:
+        while self._pos < len(self._texto) and (self._texto[self._pos].isspace() or self._texto[self._pos] in caracteres):
+            self._pos += 1
+
+    def _valor(self) -> Any:
+        self._saltar()
+        c = self._actual()
+        if c is None:
+            raise _TextoIncompleto()
+        if c == '{':
+            return self._objeto()
+        if c == '[':
+            return self._lista()
+        if c in '"\'':
+            return self._cadena()
+        return self._literal(',}]"')
+
+    def _objeto(self) -> Dict[str, Any]:
+        self._pos += 1
+        resultado = {}
+        while True:
+            self._saltar(',')
+            c = self._actual()
+            if c is None:
+                raise _TextoIncompleto(resultado)
+            if c in '}]':
+                self._pos += 1
+                return resultado
+            try:
+                clave = self._cadena() if c in '"\'' else self._literal(':,}]')
+                self._saltar()
+                if self._actual() is None:
+                    raise _TextoIncompleto()
+                if self._actual() != ':':
+                    raise ValueError(f"se esperaba ':' en la posición {self._pos}")
+                self._pos += 1
+                resultado[str(clave)] = self._valor()
+            except _TextoIncompleto as e:
+                # Se conservan las listas cortadas (sus elementos completos), no los objetos ni escalares
+                if isinstance(e.parcial, list):
+                    resultado[str(clave)] = e.parcial
+                raise _TextoIncompleto(resultado)
+
+    def _lista(self) -> List[Any]:
+        self._pos += 1
+        resultado = []
+        while True:
+            self._saltar(',')
+            c = self._actual()
+            if c is None:
+                raise _TextoIncompleto(resultado)
+            if c in ']}':
+                self._pos += 1
+                return resultado
+            try:
+                if c in '{["\'':
+                    resultado.append(self._valor())
+                else:
+                    resultado.extend(self._literales_lista())
+            except _TextoIncompleto as e:
+                if isinstance(e.parcial, list):
+                    resultado.append(e.parcial)
+                raise _TextoIncompleto(resultado)
+
+    def _literales_lista(self) -> List[Any]:
+        # Números separados solo por espacios ([60112 12014]) son elementos distintos
+        literal = self._literal(',}]"')
+        if isinstance(literal, str):
+            partes = literal.split()
+            if len(partes) > 1 and all(re.fullmatch(r'-?\d+(\.\d+)?', parte) for parte in partes):
+                return [json.loads(parte) for parte in partes]
+        return [literal]
+
+    def _cadena(self) -> str:
+        comilla = self._texto[self._pos]
+        self._pos += 1
+        caracteres = []
+        while self._pos < len(self._texto):
+            c = self._texto[self._pos]
+            self._pos += 1
+            if c == '\\' and self._pos < len(self._texto):
+                siguiente = self._texto[self._pos]
+                self._pos += 1
+                caracteres.append(siguiente if siguiente == "'" else c + siguiente)
+            elif c == comilla:
+                crudo = ''.join(caracteres)
+                try:
+                    return json.loads(f'"{crudo}"', strict=False)
+                except json.JSONDecodeError:
+                    return crudo
+            elif c == '"':
+                caracteres.append('\\"')
+            else:
+                caracteres.append(c)
+        raise _TextoIncompleto()
+
+    def _literal(self, terminadores: str) -> Any:
+        inicio = self._pos
+        while self._pos < len(self._texto) and self._texto[self._pos] not in terminadores + '\n':
+            self._pos += 1
+        if self._pos >= len(self._texto):
+            raise _TextoIncompleto()
+        literal = self._texto[inicio:self._pos].strip()
+        if not literal:
+            raise ValueError(f"valor vacío en la posición {inicio}")
+        if literal in LITERALES_JSON:
+            return LITERALES_JSON[literal]
+        try:
+            return json.loads(literal)
+        except json.JSONDecodeError:
+            return literal
+
+def valor_compatible(valor: Any, definicion: Dict[str, Any]) -> bool:
+    """
+    Comprueba un valor reparado contra su definición en el schema, recursivamente.
+    Un texto donde se espera un número, booleano, lista u objeto no es compatible;
+    números y booleanos sí se aceptan en campos de texto, como sin reparación.
+    """
+    tipo = definicion.get("type")
+    if valor is None or tipo is None:
+        return True
+    if tipo in ("number", "integer"):
+        return isinstance(valor, (int, float)) and not isinstance(valor, bool)
+    if tipo == "boolean":
+        return isinstance(valor, bool)
+    if tipo == "string":
+        return not isinstance(valor, (list, dict))
+    if tipo == "array":
+        return isinstance(valor, list) and all(valor_compatible(v, definicion.get("items", {})) for v in valor)
+    if tipo == "object":
+        propiedades = definicion.get("properties", {})
+        return isinstance(valor, dict) and all(valor_compatible(v, propiedades.get(k, {})) for k, v in valor.items())
+    return True
+
+def reparar_json(texto: str) -> Optional[Dict[str, Any]]:
+    """
+    Intenta recuperar un objeto JSON de una respuesta mal formada o cortada.
+    Devuelve None si no se puede reparar.
+    """
+    return ReparadorJSON(texto).reparar()
+
 class InfoExtractor:
     def __init__(self):
         self._client = None
@@ -15,6 +347,13 @@ class InfoExtractor:
         self._messages_config = {}
         self._json_template = {}
         self._examples = ""
+        self._streaming = False
+        self._on_partial = None
+        self._on_descarte = None
+        self.ultimo_resultado_reparado = False
+        self._prefijo_compilado = None
+        self._plantilla_entrada = None
+        self.estadisticas_cache = {'respuestas': 0, 'tokens_prompt': 0, 'tokens_cacheados': 0}
 
     def set_api_key(self, api_key: str) -> 'InfoExtractor':
         self._client = OpenAI(api_key=api_key)
@@ -34,61 +373,210 @@ class InfoExtractor:
 
     def set_field_definitions(self, field_definitions: Dict[str, str]) -> 'InfoExtractor':
         self._field_definitions = field_definitions
+        self._prefijo_compilado = None
         return self
 
     def set_messages_config(self, messages_config: Dict[str, Any]) -> 'InfoExtractor':
         self._messages_config = messages_config
+        self._prefijo_compilado = None
         return self
 
     def set_json_template(self, json_template: Dict[str, Any]) -> 'InfoExtractor':
         self._json_template = json_template
+        self._prefijo_compilado = None
         return self
 
     def set_examples(self, examples: str) -> 'InfoExtractor':
         self._examples = examples
+        self._prefijo_compilado = None
         return self
 
-    def _create_messages(self, texto_entrada: str) -> List[Dict[str, str]]:
+    def set_streaming(self, streaming: bool, on_partial: Optional[Callable[[str, str, Any], None]] = None,
+                      on_descarte: Optional[Callable[[str], None]] = None) -> 'InfoExtractor':
+        self._streaming = streaming
+        self._on_partial = on_partial
+        self._on_descarte = on_descarte
+        return self
+
+    def _compilar_prefijo(self) -> List[Dict[str, str]]:
+        """
+        Construye una sola vez los mensajes estáticos (sistema, template, definiciones
+        y ejemplos). Son idénticos byte a byte en cada llamada, de modo que el servidor
+        puede reutilizarlos de su caché de prompts; solo el último mensaje cambia.
+        """
         field_definitions_text = '. '.join([
             f"'{key}': '{value}'" 
             for key, value in self._field_definitions.items()
         ])
 
-        user_message = self._messages_config["template"]["content"].format(
+        contenido_template = self._messages_config["template"]["content"]
+        if "entrada" in self._messages_config:
+            plantilla_entrada = self._messages_config["entrada"]["content"]
+        elif "{input_text}" in contenido_template:
+            # Configuración antigua: la nota va dentro del template, en {input_text}
+            contenido_template, sufijo = contenido_template.split("{input_text}", 1)
+            plantilla_entrada = "{input_text}" + sufijo
+        else:
+            plantilla_entrada = "{input_text}"
+
+        mensaje_estatico = contenido_template.format(
             json_template=json.dumps(self._json_template, ensure_ascii=False),
             field_definitions=field_definitions_text,
-            input_example=self._examples,
-            input_text=texto_entrada
+            input_example=self._examples
         )
 
-        return [
+        self._plantilla_entrada = plantilla_entrada
+        self._prefijo_compilado = [
             self._messages_config["system"],
-            {"role": "user", "content": user_message}
+            {"role": "user", "content": mensaje_estatico}
         ]
+        return self._prefijo_compilado
 
-    def extraer_informacion(self, texto: str) -> Union[Dict[str, Any], str, None]:
+    def _create_messages(self, texto_entrada: str) -> List[Dict[str, str]]:
+        prefijo = self._prefijo_compilado or self._compilar_prefijo()
+        return prefijo + [
+            {"role": "user", "content": self._plantilla_entrada.format(input_text=texto_entrada)}
+        ]
+
+    def _registrar_uso(self, model: str, usage: Any) -> None:
+        if usage is None:
+            return
+        detalles = getattr(usage, "prompt_tokens_details", None)
+        cacheados = (getattr(detalles, "cached_tokens", None) or 0) if detalles else 0
+        self.estadisticas_cache['respuestas'] += 1
+        self.estadisticas_cache['tokens_prompt'] += usage.prompt_tokens
+        self.estadisticas_cache['tokens_cacheados'] += cacheados
+        print(f"Tokens de prompt ({model}): {usage.prompt_tokens}, en caché: {cacheados}")
+
+    def resumen_cache(self) -> str:
+        estadisticas = self.estadisticas_cache
+        porcentaje = 100 * estadisticas['tokens_cacheados'] / estadisticas['tokens_prompt'] if estadisticas['tokens_prompt'] else 0
+        return (f"{estadisticas['respuestas']} respuestas, {estadisticas['tokens_cacheados']} de "
+                f"{estadisticas['tokens_prompt']} tokens de prompt en caché ({porcentaje:.1f}%)")
+
+    def _schema_properties(self) -> Dict[str, Any]:
+        schema = self._json_schema.get("json_schema", self._json_schema) if self._json_schema else {}
+        return schema.get("schema", schema).get("properties", {})
+
+    def _completar_en_streaming(self, model: str, texto: str,
+                                on_partial: Optional[Callable[[str, Any], None]]) -> Tuple[str, Optional[str]]:
+        """
+        Consume la respuesta por fragmentos y la cancela en cuanto deja de poder ser válida.
+        Devuelve el contenido recibido y el motivo de la cancelación, si la hubo.
+        """
+        parser = ParserJSONIncremental(self._schema_properties(), on_partial)
+        fragmentos = []
+
+        stream = self._client.chat.completions.create(
+            model=model,
+            messages=self._create_messages(texto),
+            response_format={"type": "json_object"},
+            stream=True,
+            stream_options={"include_usage": True},
+            **self._model_config
+        )
+        try:
+            for chunk in stream:
+                # El último fragmento no trae choices, solo el uso de tokens
+                if getattr(chunk, "usage", None):
+                    self._registrar_uso(model, chunk.usage)
+                if not chunk.choices:
+                    continue
+                fragmento = chunk.choices[0].delta.content
+                # Lo que llegue después del objeto se ignora, pero se sigue leyendo
+                # hasta el fragmento final con el uso de tokens
+                if not fragmento or parser.terminado:
+                    continue
+                fragmentos.append(fragmento)
+                if not parser.alimentar(fragmento):
+                    break
+        finally:
+            # Cerrar la conexión detiene la generación de tokens en el servidor
+            stream.close()
+
+        return "".join(fragmentos), parser.error
+
+    def _reparar_respuesta(self, contenido_respuesta: str) -> Optional[Dict[str, Any]]:
+        reparado = reparar_json(contenido_respuesta)
+        if reparado is None:
+            return None
+        propiedades = self._schema_properties()
+        # Una clave fuera del schema indica que la reparación desplazó el texto (p. ej. una
+        # cadena sin cerrar que se traga la clave siguiente): se descarta, igual que en streaming
+        desconocidas = [clave for clave in reparado if propiedades and clave not in propiedades]
+        if desconocidas:
+            print(f"La reparación produce claves fuera del schema: {', '.join(desconocidas)}")
+            return None
+        incompatibles = [clave for clave, valor in reparado.items()
+                         if not valor_compatible(valor, propiedades.get(clave, {}))]
+        if incompatibles:
+            print(f"La reparación produce tipos incompatibles con el schema en: {', '.join(incompatibles)}")
+            return None
+        # Orden del template, como el resto de registros; los campos perdidos al cortar
+        # la respuesta toman el valor por defecto del template
+        resultado = {clave: reparado[clave] if clave in reparado else json.loads(json.dumps(valor))
+                     for clave, valor in self._json_template.items()}
+        resultado.update({clave: valor for clave, valor in reparado.items() if clave not in resultado})
+        return resultado
+
+    def extraer_informacion(self, texto: str,
+                            on_partial: Optional[Callable[[str, str, Any], None]] = None,
+                            on_descarte: Optional[Callable[[str], None]] = None) -> Union[Dict[str, Any], str, None]:
+        """
+        En modo streaming, on_partial(modelo, clave, valor) recibe cada campo en cuanto
+        se completa. Si el intento de ese modelo no es el resultado devuelto (se cancela,
+        no se puede reparar o falla), se llama on_descarte(modelo) y los campos que envió
+        deben descartarse.
+        """
         if not all([self._client, self._model, self._json_schema]):
             raise ValueError("La configuración del extractor está incompleta.")
 
         models_to_try = [self._model, self._fallback_model]
         last_raw_content = None
+        on_partial = on_partial or self._on_partial
+        on_descarte = on_descarte or self._on_descarte
+        self.ultimo_resultado_reparado = False
 
         for model in models_to_try:
+            aceptado = False
             try:
-                respuesta = self._client.chat.completions.create(
-                    model=model,
-                    messages=self._create_messages(texto),
-                    response_format={"type": "json_object"},
-                    **self._model_config
-                )
-
-                contenido_respuesta = respuesta.choices[0].message.content
+                error_stream = None
+                if self._streaming:
+                    parcial_intento = (lambda clave, valor, model=model: on_partial(model, clave, valor)) if on_partial else None
+                    contenido_respuesta, error_stream = self._completar_en_streaming(model, texto, parcial_intento)
+                else:
+                    respuesta = self._client.chat.completions.create(
+                        model=model,
+                        messages=self._create_messages(texto),
+                        response_format={"type": "json_object"},
+                        **self._model_config
+                    )
+                    contenido_respuesta = respuesta.choices[0].message.content
+                    self._registrar_uso(model, respuesta.usage)
+
                 last_raw_content = contenido_respuesta
 
                 try:
-                    return json.loads(contenido_respuesta)
+                    if error_stream:
+                        raise RespuestaAbortadaError(error_stream)
+                    resultado = json.loads(contenido_respuesta)
+                    aceptado = True
+                    return resultado
+                except RespuestaAbortadaError as e:
+                    print(f"Respuesta cancelada con el modelo {model}: {str(e)}")
+                    if model == self._fallback_model:
+                        print("Fallaron todos los intentos de extracción JSON. Devolviendo el contenido crudo.")
+                        return contenido_respuesta
+                    else:
+                        print(f"Intentando con el modelo de respaldo: {self._fallback_model}")
                 except json.JSONDecodeError:
                     print(f"No se pudo decodificar la respuesta como JSON usando el modelo {model}.")
+                    reparado = self._reparar_respuesta(contenido_respuesta)
+                    if reparado is not None:
+                        print("Respuesta reparada localmente, sin recurrir al modelo de respaldo.")
+                        self.ultimo_resultado_reparado = True
+                        aceptado = True
+                        return reparado
                     if model == self._fallback_model:
                         print("Fallaron todos los intentos de extracción JSON. Devolviendo el contenido crudo.")
                         return contenido_respuesta
@@ -107,6 +595,9 @@ class InfoExtractor:
                         return None
                 else:
                     print(f"Intentando con el modelo de respaldo: {self._fallback_model}")
+            finally:
+                if self._streaming and on_descarte and not aceptado:
+                    on_descarte(model)
 
         return None  # Este return solo se alcanzará si hay un error inesperado en la lógica del bucle
 
@@ -188,6 +679,11 @@ class InfoExtractorBuilder:
         self._extractor.set_examples(examples)
         return self
 
+    def with_streaming(self, streaming: bool, on_partial: Optional[Callable[[str, str, Any], None]] = None,
+                       on_descarte: Optional[Callable[[str], None]] = None) -> 'InfoExtractorBuilder':
+        self._extractor.set_streaming(streaming, on_partial, on_descarte)
+        return self
+
     def build(self) -> InfoExtractor:
         return self._extractor
 
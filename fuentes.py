@@ -0,0 +1,144 @@
+import os
+import queue
+import fnmatch
+import tarfile
+import zipfile
+import threading
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+try:
+    from charset_normalizer import from_bytes
+except ImportError:
+    from_bytes = None
+
+PATRON_ENTRADA = '*_MasterLimpio.txt'
+
+# Codificaciones de respaldo cuando el contenido no es UTF-8
+CODIFICACIONES_RESPALDO = ['cp1252', 'latin-1']
+
+EXTENSIONES_TAR = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+def detectar_codificacion(datos: bytes) -> Optional[str]:
+    """
+    Estima la codificación de un contenido que no es UTF-8 con charset_normalizer
+    (si está instalado), a partir de sus primeros 64 KB.
+    """
+    if from_bytes is None:
+        return None
+    mejor = from_bytes(datos[:64 * 1024]).best()
+    return mejor.encoding if mejor is not None else None
+
+def decodificar(datos: bytes) -> str:
+    # La gran mayoría de los archivos son UTF-8: se intenta primero sin detección
+    try:
+        return str(datos, 'utf-8-sig')
+    except UnicodeDecodeError:
+        pass
+
+    # La detección solo mira el principio del archivo; si falla con el contenido
+    # completo se prueban las de respaldo (latin-1 decodifica cualquier byte)
+    for codificacion in [detectar_codificacion(datos)] + CODIFICACIONES_RESPALDO:
+        if not codificacion:
+            continue
+        try:
+            contenido = str(datos, codificacion)
+        except (UnicodeDecodeError, LookupError):
+            continue
+        print(f"Contenido no UTF-8, se decodifica como {codificacion}")
+        return contenido
+    return str(datos, 'latin-1')
+
+def leer_archivo(ruta: str) -> str:
+    with open(ruta, 'rb') as f:
+        return decodificar(f.read())
+
+def _es_tar(ruta: str) -> bool:
+    return ruta.lower().endswith(EXTENSIONES_TAR)
+
+def _iterar_zip(ruta: str, patron: str) -> Iterator[Tuple[str, str]]:
+    with zipfile.ZipFile(ruta) as archivo_zip:
+        for miembro in archivo_zip.infolist():
+            nombre_archivo = os.path.basename(miembro.filename)
+            if not miembro.is_dir() and fnmatch.fnmatch(nombre_archivo, patron):
+                with archivo_zip.open(miembro) as f:
+                    yield nombre_archivo, decodificar(f.read())
+
+def _iterar_tar(ruta: str, patron: str) -> Iterator[Tuple[str, str]]:
+    # Modo stream ('r|*'): los miembros se descomprimen en orden, sin acceso aleatorio
+    with tarfile.open(ruta, 'r|*') as archivo_tar:
+        for miembro in archivo_tar:
+            nombre_archivo = os.path.basename(miembro.name)
+            if miembro.isfile() and fnmatch.fnmatch(nombre_archivo, patron):
+                f = archivo_tar.extractfile(miembro)
+                if f is not None:
+                    yield nombre_archivo, decodificar(f.read())
+
+def _iterar_rutas(rutas: Iterable[str], patron: str) -> Iterator[Tuple[str, str]]:
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            hijos = [os.path.join(ruta, nombre) for nombre in sorted(os.listdir(ruta))]
+            yield from _iterar_rutas([h for h in hijos if not os.path.isdir(h)], patron)
+        elif zipfile.is_zipfile(ruta):
+            yield from _iterar_zip(ruta, patron)
+        elif _es_tar(ruta):
+            yield from _iterar_tar(ruta, patron)
+        elif ruta.lower().endswith('.rar'):
+            print(f"Formato .rar no soportado, se omite: {ruta}")
+        elif fnmatch.fnmatch(os.path.basename(ruta), patron):
+            yield os.path.basename(ruta), leer_archivo(ruta)
+
+def iterar_fuentes(rutas: Iterable[str], patron: str = PATRON_ENTRADA) -> Iterator[Tuple[str, str]]:
+    """
+    Genera pares (nombre_archivo, contenido) a partir de directorios, archivos
+    sueltos y archivos .zip/.tar. Para los miembros de un archivo comprimido,
+    nombre_archivo es el nombre base del miembro, de modo que los campos que
+    procesar_archivo obtiene del nombre siguen funcionando. Un nombre base
+    repetido recibe un sufijo (_2, _3...) para no sobrescribir la salida anterior.
+    """
+    vistos: Dict[str, int] = {}
+    for nombre_archivo, contenido in _iterar_rutas(rutas, patron):
+        vistos[nombre_archivo] = vistos.get(nombre_archivo, 0) + 1
+        if vistos[nombre_archivo] > 1:
+            base, extension = os.path.splitext(nombre_archivo)
+            nombre_unico = f"{base}_{vistos[nombre_archivo]}{extension}"
+            print(f"Nombre de archivo repetido: {nombre_archivo}, se procesa como {nombre_unico}")
+            nombre_archivo = nombre_unico
+        yield nombre_archivo, contenido
+
+_FIN = object()
+
+def leer_con_prefetch(fuentes: Iterable[Tuple[str, str]], tamano_cola: int = 2) -> Iterator[Tuple[str, str]]:
+    """
+    Lee las fuentes en un hilo aparte y las entrega a través de una cola acotada,
+    de modo que la lectura y descompresión se solapan con la extracción.
+    """
+    cola: queue.Queue = queue.Queue(maxsize=tamano_cola)
+    detener = threading.Event()
+
+    def productor():
+        try:
+            for elemento in fuentes:
+                while not detener.is_set():
+                    try:
+                        cola.put(elemento, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if detener.is_set():
+                    return
+            cola.put(_FIN)
+        except Exception as e:
+            cola.put(e)
+
+    hilo = threading.Thread(target=productor, daemon=True)
+    hilo.start()
+    try:
+        while True:
+            elemento = cola.get()
+            if elemento is _FIN:
+                break
+            if isinstance(elemento, Exception):
+                raise elemento
+            yield elemento
+    finally:
+        detener.set()
@@ -0,0 +1,263 @@
+import os
+import json
+import sqlite3
+import argparse
+from typing import Dict, Any, List, Iterable, Optional
+
+ruta_indice = './indice.sqlite'
+directorio_json = './json/'
+
+# Columnas de primer nivel de 'data' que se copian al índice
+CAMPOS_REGISTRO = ['ship_name', 'master_name', 'broker_name', 'travel_departure_port']
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS registros (
+    id INTEGER PRIMARY KEY,
+    name_txt TEXT NOT NULL,
+    id_entrada INTEGER NOT NULL,
+    publication_date TEXT,
+    publication_name TEXT,
+    news_section TEXT,
+    fecha_entrada TEXT,
+    ship_name TEXT,
+    master_name TEXT,
+    broker_name TEXT,
+    travel_departure_port TEXT,
+    entrada TEXT,
+    data TEXT,
+    UNIQUE (name_txt, id_entrada)
+);
+CREATE TABLE IF NOT EXISTS cargas (
+    registro_id INTEGER NOT NULL REFERENCES registros(id) ON DELETE CASCADE,
+    cargo_merchant_name TEXT,
+    cargo_quantity TEXT,
+    cargo_unit TEXT,
+    cargo_commodity TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_registros_ship_name ON registros(ship_name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_registros_master_name ON registros(master_name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_registros_broker_name ON registros(broker_name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_registros_departure_port ON registros(travel_departure_port COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_registros_fecha_entrada ON registros(fecha_entrada);
+CREATE INDEX IF NOT EXISTS idx_cargas_registro ON cargas(registro_id);
+CREATE INDEX IF NOT EXISTS idx_cargas_merchant_name ON cargas(cargo_merchant_name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_cargas_commodity ON cargas(cargo_commodity COLLATE NOCASE);
+CREATE VIRTUAL TABLE IF NOT EXISTS registros_fts USING fts5(
+    entrada, ship_name, master_name, broker_name, travel_departure_port, cargas,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+def abrir_indice(ruta: str = ruta_indice) -> sqlite3.Connection:
+    conn = sqlite3.connect(ruta)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.executescript(ESQUEMA)
+    return conn
+
+def _normalizar_fecha(fecha: Optional[str]) -> Optional[str]:
+    # fecha_entrada se guarda como YYYY_MM_DD; se aceptan también YYYY-MM-DD y YYYY-MM
+    return fecha.replace('-', '_') if fecha else None
+
+def _extraer_cargas(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    cargas = []
+    for destinatario in data.get('cargo_list') or []:
+        if not isinstance(destinatario, dict):
+            continue
+        for carga in destinatario.get('cargo') or [None]:
+            carga = carga if isinstance(carga, dict) else {}
+            cantidad = carga.get('cargo_quantity')
+            cargas.append({
+                'cargo_merchant_name': destinatario.get('cargo_merchant_name'),
+                'cargo_quantity': json.dumps(cantidad, ensure_ascii=False) if cantidad is not None else None,
+                'cargo_unit': carga.get('cargo_unit'),
+                'cargo_commodity': carga.get('cargo_commodity'),
+            })
+    return cargas
+
+def indexar_registros(conn: sqlite3.Connection, registros: Iterable[Dict[str, Any]]) -> int:
+    """
+    Carga en el índice los registros devueltos por procesar_archivo.
+    Los registros de cada archivo (name_txt) reemplazan por completo a los
+    que ese archivo tuviera de una ejecución anterior.
+    """
+    registros = list(registros)
+    total = 0
+    with conn:
+        for name_txt in {registro['name_txt'] for registro in registros}:
+            conn.execute("DELETE FROM registros_fts WHERE rowid IN (SELECT id FROM registros WHERE name_txt = ?)",
+                         (name_txt,))
+            conn.execute("DELETE FROM registros WHERE name_txt = ?", (name_txt,))
+
+        for registro in registros:
+            data = registro.get('data')
+            # 'data' puede ser el contenido crudo o un error si la extracción falló
+            data = data if isinstance(data, dict) and 'error' not in data else {}
+            campos = {campo: data.get(campo) if isinstance(data.get(campo), str) else None
+                      for campo in CAMPOS_REGISTRO}
+            cargas = _extraer_cargas(data)
+
+            cursor = conn.execute(
+                "INSERT INTO registros (name_txt, id_entrada, publication_date, publication_name, news_section, "
+                "fecha_entrada, ship_name, master_name, broker_name, travel_departure_port, entrada, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (registro['name_txt'], registro['id_entrada'], registro.get('publication_date'),
+                 registro.get('publication_name'), registro.get('news_section'), registro.get('fecha_entrada'),
+                 campos['ship_name'], campos['master_name'], campos['broker_name'],
+                 campos['travel_departure_port'], registro.get('entrada'),
+                 json.dumps(registro.get('data'), ensure_ascii=False))
+            )
+            registro_id = cursor.lastrowid
+
+            conn.executemany(
+                "INSERT INTO cargas (registro_id, cargo_merchant_name, cargo_quantity, cargo_unit, cargo_commodity) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(registro_id, c['cargo_merchant_name'], c['cargo_quantity'], c['cargo_unit'], c['cargo_commodity'])
+                 for c in cargas]
+            )
+
+            texto_cargas = ' '.join(
+                f"{c['cargo_merchant_name'] or ''} {c['cargo_commodity'] or ''}" for c in cargas
+            )
+            conn.execute(
+                "INSERT INTO registros_fts (rowid, entrada, ship_name, master_name, broker_name, "
+                "travel_departure_port, cargas) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (registro_id, registro.get('entrada') or '', campos['ship_name'] or '', campos['master_name'] or '',
+                 campos['broker_name'] or '', campos['travel_departure_port'] or '', texto_cargas)
+            )
+            total += 1
+    return total
+
+def indexar_directorio(conn: sqlite3.Connection, directorio: str = directorio_json) -> int:
+    total = 0
+    for nombre_archivo in sorted(os.listdir(directorio)):
+        if nombre_archivo.endswith('_procesado.json'):
+            with open(os.path.join(directorio, nombre_archivo), 'r', encoding='utf-8') as f:
+                total += indexar_registros(conn, json.load(f))
+    return total
+
+def _filtros_registro(ship_name=None, master_name=None, broker_name=None, travel_departure_port=None,
+                      fecha_desde=None, fecha_hasta=None, news_section=None, texto=None):
+    condiciones, parametros = [], []
+    for columna, valor in (('ship_name', ship_name), ('master_name', master_name),
+                           ('broker_name', broker_name), ('travel_departure_port', travel_departure_port)):
+        if valor:
+            condiciones.append(f"r.{columna} = ? COLLATE NOCASE")
+            parametros.append(valor)
+    if news_section:
+        condiciones.append("r.news_section = ?")
+        parametros.append(news_section)
+    if fecha_desde:
+        condiciones.append("r.fecha_entrada >= ?")
+        parametros.append(_normalizar_fecha(fecha_desde))
+    if fecha_hasta:
+        # '~' ordena después de los dígitos, así '1880_01' incluye todo el mes
+        condiciones.append("r.fecha_entrada <= ?")
+        parametros.append(_normalizar_fecha(fecha_hasta) + '~')
+    if texto:
+        condiciones.append("r.id IN (SELECT rowid FROM registros_fts WHERE registros_fts MATCH ?)")
+        parametros.append(texto)
+    return condiciones, parametros
+
+def buscar(conn: sqlite3.Connection, cargo_merchant_name: Optional[str] = None,
+           cargo_commodity: Optional[str] = None, limite: Optional[int] = None,
+           **filtros) -> List[Dict[str, Any]]:
+    """
+    Devuelve los registros que cumplen todos los filtros indicados.
+    Filtros: ship_name, master_name, broker_name, travel_departure_port, news_section,
+    fecha_desde, fecha_hasta (YYYY_MM_DD, YYYY-MM-DD o prefijos como 1880-01) y
+    texto (consulta FTS5 sobre la entrada, nombres y cargas).
+    """
+    condiciones, parametros = _filtros_registro(**filtros)
+    for columna, valor in (('cargo_merchant_name', cargo_merchant_name), ('cargo_commodity', cargo_commodity)):
+        if valor:
+            condiciones.append(f"r.id IN (SELECT registro_id FROM cargas WHERE {columna} = ? COLLATE NOCASE)")
+            parametros.append(valor)
+
+    consulta = "SELECT r.* FROM registros r"
+    if condiciones:
+        consulta += " WHERE " + " AND ".join(condiciones)
+    consulta += " ORDER BY r.fecha_entrada, r.name_txt, r.id_entrada"
+    if limite:
+        consulta += f" LIMIT {int(limite)}"
+
+    resultados = []
+    for fila in conn.execute(consulta, parametros):
+        registro = dict(fila)
+        registro['data'] = json.loads(registro['data']) if registro['data'] else None
+        del registro['id']
+        resultados.append(registro)
+    return resultados
+
+def buscar_cargas(conn: sqlite3.Connection, cargo_merchant_name: Optional[str] = None,
+                  cargo_commodity: Optional[str] = None, limite: Optional[int] = None,
+                  **filtros) -> List[Dict[str, Any]]:
+    """
+    Devuelve las cargas (una fila por mercancía) junto con el buque y la fecha de entrada.
+    Acepta los mismos filtros que buscar.
+    """
+    condiciones, parametros = _filtros_registro(**filtros)
+    for columna, valor in (('cargo_merchant_name', cargo_merchant_name), ('cargo_commodity', cargo_commodity)):
+        if valor:
+            condiciones.append(f"c.{columna} = ? COLLATE NOCASE")
+            parametros.append(valor)
+
+    consulta = (
+        "SELECT r.name_txt, r.id_entrada, r.fecha_entrada, r.ship_name, r.travel_departure_port, "
+        "c.cargo_merchant_name, c.cargo_quantity, c.cargo_unit, c.cargo_commodity "
+        "FROM cargas c JOIN registros r ON r.id = c.registro_id"
+    )
+    if condiciones:
+        consulta += " WHERE " + " AND ".join(condiciones)
+    consulta += " ORDER BY r.fecha_entrada, r.name_txt, r.id_entrada"
+    if limite:
+        consulta += f" LIMIT {int(limite)}"
+
+    resultados = []
+    for fila in conn.execute(consulta, parametros):
+        carga = dict(fila)
+        carga['cargo_quantity'] = json.loads(carga['cargo_quantity']) if carga['cargo_quantity'] else None
+        resultados.append(carga)
+    return resultados
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice local de los registros extraídos.")
+    parser.add_argument('--indice', default=ruta_indice, help="Ruta de la base SQLite.")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    parser_indexar = subparsers.add_parser('indexar', help="Indexa los archivos *_procesado.json.")
+    parser_indexar.add_argument('directorio', nargs='?', default=directorio_json)
+
+    for nombre, ayuda in (('buscar', "Busca registros."), ('cargas', "Busca cargas.")):
+        sub = subparsers.add_parser(nombre, help=ayuda)
+        sub.add_argument('--ship-name')
+        sub.add_argument('--master-name')
+        sub.add_argument('--broker-name')
+        sub.add_argument('--merchant', dest='cargo_merchant_name')
+        sub.add_argument('--commodity', dest='cargo_commodity')
+        sub.add_argument('--puerto', dest='travel_departure_port')
+        sub.add_argument('--seccion', dest='news_section', choices=['T', 'C', 'M', 'E'])
+        sub.add_argument('--desde', dest='fecha_desde')
+        sub.add_argument('--hasta', dest='fecha_hasta')
+        sub.add_argument('--texto', help="Consulta de texto completo (sintaxis FTS5).")
+        sub.add_argument('--limite', type=int)
+
+    args = vars(parser.parse_args())
+    conn = abrir_indice(args.pop('indice'))
+    comando = args.pop('comando')
+
+    try:
+        if comando == 'indexar':
+            total = indexar_directorio(conn, args['directorio'])
+            print(f"Registros indexados: {total}")
+        else:
+            funcion = buscar if comando == 'buscar' else buscar_cargas
+            resultados = funcion(conn, **args)
+            print(json.dumps(resultados, ensure_ascii=False, indent=2))
+    except sqlite3.Error as e:
+        print(f"Error al consultar el índice: {str(e)}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
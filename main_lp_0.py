@@ -1,31 +1,48 @@
 import os
 import json
 import re
+import sqlite3
 from config_lp_0 import procesar_archivo
+from indice import abrir_indice, indexar_registros
+from fuentes import iterar_fuentes, leer_con_prefetch
 
 directorio_entrada = './txt/lp/'
+# Directorios, archivos sueltos y archivos .zip/.tar; solo se leen los *_MasterLimpio.txt
+fuentes_entrada = [directorio_entrada]
 directorio_salida = './json/'
+ruta_indice = './indice.sqlite'
 
 def main():
+    conn = None
     try:
         os.makedirs(directorio_salida, exist_ok=True)
 
-        for nombre_archivo in os.listdir(directorio_entrada):
-            if nombre_archivo.endswith('.txt'):
-                ruta_absoluta = os.path.join(directorio_entrada, nombre_archivo)
+        # El índice es una etapa secundaria: si falla, la extracción continúa sin él
+        try:
+            conn = abrir_indice(ruta_indice)
+        except sqlite3.Error as e:
+            print(f"No se pudo abrir el índice, se continúa sin indexar: {str(e)}")
 
-                with open(ruta_absoluta, 'r', encoding='utf-8') as file:
-                    contenido = file.read()
-                    resultados = procesar_archivo(nombre_archivo, contenido)
+        for nombre_archivo, contenido in leer_con_prefetch(iterar_fuentes(fuentes_entrada)):
+            resultados = procesar_archivo(nombre_archivo, contenido)
 
-                nombre_salida = f"{os.path.splitext(nombre_archivo)[0]}_procesado.json"
-                ruta_salida = os.path.join(directorio_salida, nombre_salida)
-                
-                with open(ruta_salida, 'w', encoding='utf-8') as f:
-                    json.dump(resultados, f, ensure_ascii=False, indent=2)
+            nombre_salida = f"{os.path.splitext(nombre_archivo)[0]}_procesado.json"
+            ruta_salida = os.path.join(directorio_salida, nombre_salida)
+
+            with open(ruta_salida, 'w', encoding='utf-8') as f:
+                json.dump(resultados, f, ensure_ascii=False, indent=2)
+
+            if conn:
+                try:
+                    indexar_registros(conn, resultados)
+                except sqlite3.Error as e:
+                    print(f"Error al indexar {nombre_archivo}: {str(e)}")
 
     except Exception as e:
         print(f"Error al procesar los archivos: {str(e)}")
+    finally:
+        if conn:
+            conn.close()
 
 if __name__ == "__main__":
     main()
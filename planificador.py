@@ -0,0 +1,231 @@
+import json
+import math
+import argparse
+from collections import defaultdict
+from typing import Dict, Any, List, Iterable, Tuple
+
+from config_lp_0 import MODELO, MODEL_CONFIG, JSON_TEMPLATE, crear_extractor, generar_entradas
+from fuentes import iterar_fuentes
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+fuentes_entrada = ['./txt/lp/']
+
+# Precios en USD por millón de tokens (entrada, entrada en caché, salida).
+# La Batch API cobra la mitad del precio sin caché.
+PRECIOS = {
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+    'gpt-4o': (2.50, 1.25, 10.00),
+}
+DESCUENTO_BATCH = 0.5
+
+# Tokens de salida por token de entrada de la nota, medido sobre los JSON de json/
+# (sin contar el esqueleto fijo del template, que se suma aparte)
+RATIO_SALIDA = 3.0
+
+# Tokens que la API añade por mensaje y para iniciar la respuesta
+TOKENS_POR_MENSAJE = 3
+TOKENS_RESPUESTA = 3
+
+class ContadorTokens:
+    """
+    Cuenta tokens localmente con tiktoken. Si no está instalado, estima
+    cuatro caracteres por token.
+    """
+    def __init__(self, modelo: str):
+        self._codificador = None
+        if tiktoken is not None:
+            try:
+                self._codificador = tiktoken.encoding_for_model(modelo)
+            except KeyError:
+                self._codificador = tiktoken.get_encoding('o200k_base')
+
+    @property
+    def exacto(self) -> bool:
+        return self._codificador is not None
+
+    def contar(self, texto: str) -> int:
+        if self._codificador is None:
+            return math.ceil(len(texto) / 4)
+        return len(self._codificador.encode(texto))
+
+    def contar_mensajes(self, mensajes: List[Dict[str, str]]) -> int:
+        return sum(TOKENS_POR_MENSAJE + self.contar(m['content']) for m in mensajes) + TOKENS_RESPUESTA
+
+def contar_corpus(fuentes: Iterable[Tuple[str, str]], modelos: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Segmenta cada archivo y cuenta, para cada modelo, los tokens de los mensajes
+    que se enviarían por entrada, sin llamar a la API.
+    """
+    extractor = crear_extractor(con_cliente=False)
+    contadores = {modelo: ContadorTokens(modelo) for modelo in modelos}
+    # Mensajes estáticos idénticos en todas las peticiones (ver InfoExtractor._compilar_prefijo)
+    prefijo = extractor._compilar_prefijo()
+    tokens_prefijo = {modelo: contador.contar_mensajes(prefijo) - TOKENS_RESPUESTA
+                      for modelo, contador in contadores.items()}
+    tokens_template = {modelo: contador.contar(json.dumps(JSON_TEMPLATE, ensure_ascii=False))
+                       for modelo, contador in contadores.items()}
+    maximo_salida = MODEL_CONFIG.get('max_tokens')
+
+    entradas = {modelo: [] for modelo in modelos}
+    for nombre_archivo, contenido in fuentes:
+        for registro in generar_entradas(nombre_archivo, contenido):
+            mensajes = extractor._create_messages(registro['entrada'])
+            for modelo, contador in contadores.items():
+                tokens_salida = tokens_template[modelo] + round(RATIO_SALIDA * contador.contar(registro['entrada']))
+                if maximo_salida:
+                    tokens_salida = min(tokens_salida, maximo_salida)
+                tokens_entrada = contador.contar_mensajes(mensajes)
+                entradas[modelo].append({
+                    'name_txt': nombre_archivo,
+                    'news_section': registro['news_section'],
+                    'tokens_entrada': tokens_entrada,
+                    'tokens_prefijo': tokens_prefijo[modelo],
+                    'tokens_salida': tokens_salida,
+                    # El límite TPM descuenta max_tokens por petición, no la salida real
+                    'tokens_tpm': tokens_entrada + max(maximo_salida or 0, tokens_salida),
+                })
+    return entradas
+
+def _totales(entradas: List[Dict[str, Any]], clave: str) -> Dict[str, Dict[str, int]]:
+    totales = defaultdict(lambda: {'peticiones': 0, 'tokens_entrada': 0, 'tokens_prefijo': 0,
+                                   'tokens_salida': 0, 'tokens_tpm': 0})
+    for entrada in entradas:
+        total = totales[entrada[clave]]
+        total['peticiones'] += 1
+        total['tokens_entrada'] += entrada['tokens_entrada']
+        total['tokens_prefijo'] += entrada['tokens_prefijo']
+        total['tokens_salida'] += entrada['tokens_salida']
+        total['tokens_tpm'] += entrada['tokens_tpm']
+    return dict(totales)
+
+def estimar_coste(peticiones: int, tokens_entrada: int, tokens_prefijo: int, tokens_salida: int,
+                  modelo: str) -> Dict[str, Any]:
+    """
+    En tiempo real, el prefijo estático se cobra a precio de caché en todas las
+    peticiones salvo la primera; el resto de la entrada, a precio normal. Para
+    Batch se aplica el descuento sobre el precio sin caché.
+    """
+    precio_entrada, precio_cacheado, precio_salida = PRECIOS[modelo]
+    tokens_cacheados = tokens_prefijo - tokens_prefijo // peticiones if peticiones else 0
+    tiempo_real = ((tokens_entrada - tokens_cacheados) * precio_entrada + tokens_cacheados * precio_cacheado
+                   + tokens_salida * precio_salida) / 1_000_000
+    batch = (tokens_entrada * precio_entrada + tokens_salida * precio_salida) / 1_000_000 * DESCUENTO_BATCH
+    return {
+        'tiempo_real': round(tiempo_real, 4),
+        'batch': round(batch, 4),
+        'tokens_entrada_cacheados': tokens_cacheados,
+        'ruta_mas_barata': 'batch' if batch < tiempo_real else 'tiempo_real',
+        'diferencia': round(abs(tiempo_real - batch), 4),
+    }
+
+def estimar_duracion(peticiones: int, tokens_salida: int, tokens_tpm: int, concurrencia: int,
+                     rpm: int, tpm: int, tokens_por_segundo: float, latencia_base: float) -> Dict[str, float]:
+    """
+    Estima la duración en segundos de la ruta en tiempo real como el mayor de
+    tres límites: peticiones por minuto, tokens por minuto y concurrencia.
+    tokens_tpm son los tokens que el límite TPM descuenta: la entrada más
+    max_tokens de cada petición.
+    """
+    if peticiones == 0:
+        return {'segundos': 0.0, 'limite': None}
+    latencia_media = latencia_base + (tokens_salida / peticiones) / tokens_por_segundo
+    limites = {
+        'rpm': peticiones / rpm * 60,
+        'tpm': tokens_tpm / tpm * 60,
+        'concurrencia': peticiones * latencia_media / concurrencia,
+    }
+    limite = max(limites, key=limites.get)
+    return {'segundos': round(limites[limite], 1), 'limite': limite}
+
+def repartir_en_shards(totales_archivo: Dict[str, Dict[str, int]], numero_shards: int) -> List[Dict[str, Any]]:
+    """
+    Reparte los archivos en shards de tokens equilibrados: cada archivo, de mayor
+    a menor, va al shard que tenga menos tokens hasta el momento.
+    """
+    shards = [{'archivos': [], 'peticiones': 0, 'tokens': 0} for _ in range(max(1, numero_shards))]
+    ordenados = sorted(totales_archivo.items(),
+                       key=lambda item: item[1]['tokens_entrada'] + item[1]['tokens_salida'], reverse=True)
+    for nombre_archivo, total in ordenados:
+        shard = min(shards, key=lambda s: s['tokens'])
+        shard['archivos'].append(nombre_archivo)
+        shard['peticiones'] += total['peticiones']
+        shard['tokens'] += total['tokens_entrada'] + total['tokens_salida']
+    return [shard for shard in shards if shard['archivos']]
+
+def planificar(fuentes: Iterable[Tuple[str, str]], modelos: List[str], concurrencia: int, rpm: int, tpm: int,
+               tokens_por_segundo: float, latencia_base: float, numero_shards: int) -> Dict[str, Any]:
+    plan = {'modelos': {}}
+
+    for modelo, entradas in contar_corpus(fuentes, modelos).items():
+        total = _totales(entradas, 'name_txt')
+        peticiones = sum(t['peticiones'] for t in total.values())
+        tokens_entrada = sum(t['tokens_entrada'] for t in total.values())
+        tokens_prefijo = sum(t['tokens_prefijo'] for t in total.values())
+        tokens_salida = sum(t['tokens_salida'] for t in total.values())
+        tokens_tpm = sum(t['tokens_tpm'] for t in total.values())
+
+        coste = estimar_coste(peticiones, tokens_entrada, tokens_prefijo, tokens_salida, modelo)
+        plan['modelos'][modelo] = {
+            'tokenizador_exacto': ContadorTokens(modelo).exacto,
+            'peticiones': peticiones,
+            'tokens_entrada': tokens_entrada,
+            'tokens_prefijo_estatico': tokens_prefijo,
+            'tokens_salida_estimados': tokens_salida,
+            'por_archivo': total,
+            'por_seccion': _totales(entradas, 'news_section'),
+            'coste_usd': coste,
+            'duracion_tiempo_real': estimar_duracion(peticiones, tokens_salida, tokens_tpm, concurrencia,
+                                                     rpm, tpm, tokens_por_segundo, latencia_base),
+            'shards': repartir_en_shards(total, numero_shards),
+        }
+    return plan
+
+def imprimir_resumen(plan: Dict[str, Any]) -> None:
+    for modelo, datos in plan['modelos'].items():
+        print(f"Modelo {modelo}{'' if datos['tokenizador_exacto'] else ' (tokens estimados, tiktoken no instalado)'}")
+        print(f"  Peticiones: {datos['peticiones']}, tokens de entrada: {datos['tokens_entrada']} "
+              f"({datos['tokens_prefijo_estatico']} del prefijo estático), "
+              f"tokens de salida estimados: {datos['tokens_salida_estimados']}")
+        for seccion, total in sorted(datos['por_seccion'].items()):
+            print(f"  Sección {seccion}: {total['peticiones']} peticiones, "
+                  f"{total['tokens_entrada']} + {total['tokens_salida']} tokens")
+        coste = datos['coste_usd']
+        duracion = datos['duracion_tiempo_real']
+        print(f"  Coste: {coste['tiempo_real']} USD en tiempo real ({coste['tokens_entrada_cacheados']} tokens "
+              f"en caché), {coste['batch']} USD con Batch (ventana de hasta 24 h); más barata: "
+              f"{coste['ruta_mas_barata']} por {coste['diferencia']} USD")
+        print(f"  Duración en tiempo real: {duracion['segundos'] / 60:.1f} min (límite: {duracion['limite']})")
+        for i, shard in enumerate(datos['shards'], 1):
+            print(f"  Shard {i}: {len(shard['archivos'])} archivos, {shard['peticiones']} peticiones, "
+                  f"{shard['tokens']} tokens")
+
+def main():
+    parser = argparse.ArgumentParser(description="Estima tokens, coste y duración de una extracción sin llamar a la API.")
+    parser.add_argument('fuentes', nargs='*', default=fuentes_entrada,
+                        help="Directorios, archivos o archivos .zip/.tar de entrada.")
+    parser.add_argument('--modelo', action='append', choices=sorted(PRECIOS),
+                        help=f"Modelo a evaluar (repetible). Por defecto {MODELO}.")
+    parser.add_argument('--concurrencia', type=int, default=8)
+    parser.add_argument('--rpm', type=int, default=500, help="Límite de peticiones por minuto.")
+    parser.add_argument('--tpm', type=int, default=200_000, help="Límite de tokens por minuto.")
+    parser.add_argument('--tokens-por-segundo', type=float, default=80.0,
+                        help="Velocidad de generación de salida por petición.")
+    parser.add_argument('--latencia-base', type=float, default=0.5, help="Segundos hasta el primer token.")
+    parser.add_argument('--shards', type=int, default=1, help="Número de shards del plan de trabajo.")
+    parser.add_argument('--salida', help="Ruta donde guardar el plan en JSON.")
+    args = parser.parse_args()
+
+    plan = planificar(iterar_fuentes(args.fuentes), args.modelo or [MODELO], args.concurrencia, args.rpm,
+                      args.tpm, args.tokens_por_segundo, args.latencia_base, args.shards)
+    imprimir_resumen(plan)
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(plan, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()